@@ -1,22 +1,41 @@
+import asyncio
+import functools
+import logging
 import os
+import sys
 from dotenv import load_dotenv
-from google import genai
-from google.genai.types import File
 from langchain_google_genai import ChatGoogleGenerativeAI
 
-from src.agent import create_financial_agent
+from src.agent import AGENT_STOPPED_OUTPUT, create_financial_agent, create_tool_router
+from src.ingest import upload_pdf_streaming
+from src.llm_cache import LLMCache, cache_key
+from src.preprocess import extract_financial_facts
+from src.tools import (
+    CACHE_STATS, TOOL_ERRORS, document_token_count, record_cache_hit, release_context_caches, token_usage_report
+)
+from src.utils import StreamPrinter, file_digest, get_genai_client, run_in_daemon_thread
+
+try:
+    import readline  # noqa: F401  Enables arrow-key line editing and history for input()
+except ImportError:
+    pass   # readline is not available on Windows
 
 # Necessary Parameters
 LLM_MODEL_NAME = "gemini-2.0-flash"
+FAST_LLM_MODEL_NAME = "gemini-2.0-flash-lite"   # Smaller model for the revenue and metrics extraction tools
 DATA_DIR = "data"
 uploaded_file_details = None   # To store URI and mime_type
 
+# Greetings and acknowledgements, answered without calling the model
+TRIVIAL_QUERIES = {"hi", "hello", "hey", "thanks", "thank you", "ok", "okay", "cool", "great"}
+TRIVIAL_RESPONSE = "Happy to help! Ask me for a summary, the revenue trends or the key financial metrics of '{display_name}'."
+
 # Set up Genai SDK and LLM
 load_dotenv()
 gemini_api_key = os.getenv("GEMINI_API_KEY")
 
-# GenAI SDK Client Setup - set as a global var
-client = genai.Client(api_key=gemini_api_key)
+# GenAI SDK Client Setup - shared with src modules that need file or cache operations
+client = get_genai_client()
 
 
 
@@ -52,23 +71,29 @@ def initialize_llm():
         print(f"Error initializing Gemini LLM ({LLM_MODEL_NAME}): {e}")
         print("Please check your API key, model name, and Internet connection.")
         return None
-    
 
-# Upload PDF file to Gemini
-def upload_pdf_to_gemini(pdf_path: str, display_name: str) -> File | None:
+
+def initialize_fast_llm():
     """
-    Uploads the PDF file to Gemini and returns File object.
+    Initializes the smaller Gemini model used by the extraction-style tools.
+    The model is looked up once first, since creating the LangChain client does not contact the API.
+    Returns None if the model is unavailable, in which case every tool uses the main LLM.
     """
-    print(f"\nUploading '{display_name}' to Gemini... This may take a moment.")
     try:
-        pdf_file = client.files.upload(file=pdf_path)
-        print(f"File uploaded successfully. URI: {pdf_file.uri}")
-        return pdf_file
+        client.models.get(model=FAST_LLM_MODEL_NAME)   # Raises if the model is unknown or not permitted for this key
+        fast_llm = ChatGoogleGenerativeAI(
+            model=FAST_LLM_MODEL_NAME,
+            google_api_key=gemini_api_key,
+            temperature=0.2,
+            disable_streaming=False
+        )
+        print(f"LangChain Gemini LLM ({FAST_LLM_MODEL_NAME}) initialized for extraction tools.")
+        return fast_llm
     except Exception as e:
-        print(f"Error uploading PDF to Gemini: {e}")
-        print("Please check API key permissions for file uploading and network connection.")
+        print(f"Could not initialize {FAST_LLM_MODEL_NAME}, all tools will use {LLM_MODEL_NAME}: {e}")
         return None
-    
+
+
 def get_pdf_path_from_user() -> str | None:
     """
     Prompts the user for a PDF filename and validates its existence in DATA_DIR.
@@ -83,10 +108,13 @@ def get_pdf_path_from_user() -> str | None:
         return None
     
     while True:
-        pdf_file_name = input(
-            f"\nEnter the name of the PDF file in the '{DATA_DIR}' folder "
-            f"(e.g., Meta_Q1_2024_Earnings.pdf), or type 'quit' to exit: "
-        )
+        try:
+            pdf_file_name = input(
+                f"\nEnter the name of the PDF file in the '{DATA_DIR}' folder "
+                f"(e.g., Meta_Q1_2024_Earnings.pdf), or type 'quit' to exit: "
+            )
+        except EOFError:
+            return None   # Input ended (e.g. piped input ran out)
         if pdf_file_name.lower() == 'quit':
             return None
         
@@ -103,7 +131,11 @@ def get_pdf_path_from_user() -> str | None:
 
             # List available PDF files in data directory
             try:
-                pdf_files_in_data = [f for f in os.listdir(DATA_DIR) if f.lower().endswith(".pdf")]
+                with os.scandir(DATA_DIR) as entries:
+                    pdf_files_in_data = [
+                        entry.name for entry in entries
+                        if entry.is_file() and entry.name.lower().endswith(".pdf")
+                    ]
                 if pdf_files_in_data:
                     print("\nAvailable PDF files in data directory:")
                     for f_name in pdf_files_in_data:
@@ -114,37 +146,75 @@ def get_pdf_path_from_user() -> str | None:
             except OSError as e:
                 print(f"Could not list files in '{DATA_DIR}': {e}")
 
+async def read_user_query(interactive: bool) -> str | None:
+    """
+    Reads the next user query without blocking the event loop. Returns None at end of input.
+    In batch mode (stdin is a pipe or file) queries are read line by line without a prompt.
+    The read runs on a daemon thread, so Ctrl-C exits at once instead of waiting for Enter.
+    """
+    if interactive:
+        try:
+            return await run_in_daemon_thread(input, "\nYou: ")
+        except EOFError:
+            return None
+    line = await run_in_daemon_thread(sys.stdin.readline)
+    return line.rstrip("\n") if line else None
+
+
+async def attach_financial_facts(llm: ChatGoogleGenerativeAI, file_context: dict):
+    """
+    Extracts the report's facts table on a daemon thread and attaches it to file_context.
+    Until it is ready, or if extraction fails, the tools read the full document.
+    A daemon thread is used so that exiting mid-extraction does not wait for the LLM call.
+    """
+    facts = await run_in_daemon_thread(extract_financial_facts, llm, file_context)
+    if facts:
+        file_context["facts"] = facts
+
+
 # Main function
-def main_conversational_loop():
+async def main_conversational_loop():
     # global uploaded_file_details
 
-    # LLM and SDK Initialization
-    llm = initialize_llm()
-    if not llm:
-        print("LLM or GenAI SDK initialization failure. Exiting...")
-        return
-    
     # PDF Loading
     pdf_path = get_pdf_path_from_user()
     if not pdf_path:
         print("No PDF file selected. Exiting...")
         return
 
-    # Upload PDF to Gemini
+    # Upload PDF to Gemini in the background, so it overlaps with LLM initialization
     pdf_display_name = os.path.basename(pdf_path)
-    gemini_file_object = upload_pdf_to_gemini(pdf_path, pdf_display_name)
+    pdf_digest = await asyncio.to_thread(file_digest, pdf_path)
+    upload_task = asyncio.create_task(
+        asyncio.to_thread(upload_pdf_streaming, pdf_path, pdf_display_name, pdf_digest)
+    )
+
+    # LLM and SDK Initialization
+    llm = initialize_llm()
+    if not llm:
+        print("LLM or GenAI SDK initialization failure. Exiting...")
+        return
+    fast_llm = initialize_fast_llm()
+
+    gemini_file_object = await upload_task
     if not gemini_file_object:
         print("PDF Upload Failure. Exiting...")
         return
     
     # print("DEBUG: Uploaded file object:", vars(gemini_file_object))
 
-    # Wrap file object and display name together
+    # Wrap file object, display name and content digest together
     file_context = {
         "file": gemini_file_object,
-        "display_name": pdf_display_name
+        "display_name": pdf_display_name,
+        "digest": pdf_digest
     }
     
+    # Condense the report into a compact facts table in the background, without delaying the first question
+    facts_task = asyncio.create_task(attach_financial_facts(llm, file_context))
+    # Count the document's tokens once, also in the background, so cache hits can report the prefill they saved
+    token_count_task = asyncio.create_task(run_in_daemon_thread(document_token_count, llm, file_context))
+
     # Store URI and MIME type for tools
     # uploaded_file_details = {
     #     "uri": gemini_file_object.uri,
@@ -153,11 +223,15 @@ def main_conversational_loop():
     # }
 
     # Agent Creation. Passing file details
-    financial_agent_executor = create_financial_agent(llm, file_context)
+    financial_agent_executor = create_financial_agent(llm, file_context, fast_llm)
     if not financial_agent_executor:
         print("Failed to create the financial agent. Exiting...")
         return
+    tool_router = create_tool_router(llm, financial_agent_executor, file_context)
     
+    # Cache of final answers, so repeated or paraphrased questions skip the LLM
+    response_cache = LLMCache(google_api_key=gemini_api_key)
+
     print(f"\nFinancial Report Analyzer Agent is ready to discuss '{pdf_display_name}'.")
     print("Type 'exit' or 'quit' to end the conversation.")
     print("Ask questions about the loaded financial report.")
@@ -165,63 +239,139 @@ def main_conversational_loop():
 
     # For now, the tools will get the URI and reference it in their prompts
     
-    while True:
-        user_query = input("\nYou: ")
-        if user_query.lower() in ["exit", "quit"]:
-            # Clean up the uploaded file from Gemini
-            if gemini_file_object and gemini_file_object.uri:
+    interactive = sys.stdin.isatty()
+    try:
+        while True:
+            # Read input on a daemon thread so background tasks keep running while the user types
+            user_query = await read_user_query(interactive)
+            if user_query is None or user_query.lower() in ["exit", "quit"]:
+                break
+            if not user_query.strip():
+                continue
+
+            print("\nAgent: ", end="", flush=True)   # Print "Agent: " once, no newline, flush buffer
+
+            # Opening questions do not depend on the conversation. Later turns may ("ok", "what about
+            # last quarter?"), so they skip the canned reply and the response cache and go to the agent
+            opening_question = not financial_agent_executor.memory.chat_memory.messages
+
+            # Small talk does not need the report, the agent or even a cache lookup
+            if opening_question and user_query.strip().lower().rstrip("!.") in TRIVIAL_QUERIES:
+                print(TRIVIAL_RESPONSE.format(display_name=pdf_display_name))
+                continue
+
+            # Check the response cache first: exact match, then semantically similar query.
+            # The tools' own cache still serves the self-contained tool queries of later turns.
+            use_response_cache = opening_question
+            query_key = cache_key(pdf_digest, user_query, LLM_MODEL_NAME)
+            cached_response, query_embedding = None, None
+            if use_response_cache:
                 try:
-                    print(f"\nAttempting to delete uploaded file: {pdf_display_name} ({gemini_file_object.uri})")
-                    client.files.delete(name=gemini_file_object.name)
-                    print("File deleted successfully from Gemini.")
+                    cached_response, query_embedding = await asyncio.to_thread(
+                        response_cache.lookup, query_key, user_query, pdf_digest
+                    )
                 except Exception as e:
-                    print(f"Could not delete file from Gemini: {e}. It may be auto-deleted later by Google.")
-            print("Exiting agent. Goodbye!")
-            break
-        if not user_query.strip():
-            continue
+                    # A broken cache must not end the session; answer as on a miss
+                    print(f"[Cache] Response cache lookup failed, answering without it: {e}")
+            if cached_response is not None:
+                print(cached_response)
+                record_cache_hit(file_context)
+                # Keep the conversation memory consistent for follow-up questions
+                financial_agent_executor.memory.save_context({"input": user_query}, {"output": cached_response})
+                continue
 
-        print("\nAgent: ", end="", flush=True)   # Print "Agent: " once, no newline, flush buffer
-        
-        try:
-            # Use agent_executor.stream() for streaming responses
-            full_response_content = ""
-            for chunk in financial_agent_executor.stream({"input": user_query}):
-                if "output" in chunk:  # Typical for final answer from AgentExecutor
-                    print(chunk["output"], end="", flush=True)
-                    full_response_content += chunk["output"]
-            print()   # Add a newline after full response is streamed
-
-        except Exception as e:
-            print(f"\n\n[Unexpected Error] An unexpected error occurred: {e}")
-            print("If this persists, please report the issue.")
+            try:
+                # Collect chunks in a list and join once, instead of re-copying the string per chunk
+                response_parts: list[str] = []
+                printer = StreamPrinter()   # Coalesces chunks into fewer stdout writes
+                tool_errors_before = TOOL_ERRORS.total()
+
+                # Fast path: a single function-calling round trip straight to the tools, streamed as it is generated.
+                # Otherwise use agent_executor.astream(); tool calls run without blocking the loop
+                routed_chunks = await tool_router.aroute(user_query)
+                if routed_chunks is not None:
+                    async for chunk in routed_chunks:
+                        printer.write(chunk)
+                        response_parts.append(chunk)
+                else:
+                    async for chunk in financial_agent_executor.astream({"input": user_query}):
+                        if "output" in chunk:  # Typical for final answer from AgentExecutor
+                            printer.write(chunk["output"])
+                            response_parts.append(chunk["output"])
+                printer.flush()
+                print()   # Add a newline after full response is streamed
+                full_response_content = "".join(response_parts)
+
+                # Cache only successful answers, so a transient failure is not replayed in later sessions
+                answered = (full_response_content
+                            and TOOL_ERRORS.total() == tool_errors_before
+                            and AGENT_STOPPED_OUTPUT not in response_parts)
+                if use_response_cache and answered:
+                    response_cache.set(query_key, full_response_content, query_embedding, scope=pdf_digest)
+
+            except Exception as e:
+                print(f"\n\n[Unexpected Error] An unexpected error occurred: {e}")
+                print("If this persists, please report the issue.")
+    finally:
+        # Runs on exit, end of input and Ctrl-C alike
+        # The uploaded file is kept so the next run can reuse it; Gemini deletes it after 48 hours
+        if gemini_file_object and gemini_file_object.uri:
+            print(f"\nKeeping uploaded file for reuse: {pdf_display_name} ({gemini_file_object.uri})")
+        facts_task.cancel()
+        token_count_task.cancel()
+        release_context_caches()
+        response_cache.save()
+        if CACHE_STATS["hits"]:
+            print(f"[Cache] {CACHE_STATS['hits']} cached answers, "
+                  f"~{CACHE_STATS['prefill_tokens_saved']} document prefill tokens saved.")
+        for usage_line in token_usage_report():
+            print(f"[Usage] {usage_line}")
+        print("Exiting agent. Goodbye!")
 
     print("\nSession Ended.")
 
 
+# LLM used only for connection checks. Built once, then reused with its open channel
+@functools.lru_cache(maxsize=1)
+def _probe_llm() -> ChatGoogleGenerativeAI:
+    return ChatGoogleGenerativeAI(
+        model=LLM_MODEL_NAME,
+        google_api_key=gemini_api_key,
+        temperature=0,
+        max_output_tokens=1
+    )
+
+
 # Check Gemini Connection
-def check_llm_connection():
+def check_llm_connection() -> bool:
     """
     Checks if the connection to the Gemini LLM can be established.
+    Sends a 1-token probe, so repeated checks are cheap once the channel is warm.
     """
+    if not gemini_api_key:
+        print("Error: GEMINI_API_KEY not found in .env file or environment variables.")
+        return False
+
     try:
-        gemini_api_key = os.getenv("GEMINI_API_KEY")
-        if not gemini_api_key:
-            print("Error: GEMINI_API_KEY not found in .env file or environment variables.")
-            return
-        
-        llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash",
-                                     google_api_key=gemini_api_key,
-                                     temperature=0.3)
-        
         print("Attempting to connect to Gemini LLM...")
-        response = llm.invoke("Hello! What is your name?")
+        _probe_llm().invoke("ping")
         print("Successfully connected to Gemini LLM.")
-        print(f"LLM Response: {response.content}")
-
+        return True
     except Exception as e:
         print(f"An error occurred: {e}")
         print("Please check your API key, Internet connection, and model availability.")
+        return False
 
 if __name__ == "__main__":
-    main_conversational_loop()
\ No newline at end of file
+    # Library warnings (e.g. retries) go to stderr; this app's own modules log at LOG_LEVEL.
+    # Set LOG_LEVEL=DEBUG (environment or .env) to see which tools run for each query
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    log_level = os.getenv("LOG_LEVEL", "WARNING").upper()
+    if log_level not in logging.getLevelNamesMapping():
+        print(f"Unknown LOG_LEVEL '{log_level}', using WARNING. Valid levels: DEBUG, INFO, WARNING, ERROR, CRITICAL.")
+        log_level = "WARNING"
+    logging.getLogger("src").setLevel(log_level)
+    try:
+        asyncio.run(main_conversational_loop())
+    except KeyboardInterrupt:
+        print("\nInterrupted.")
\ No newline at end of file
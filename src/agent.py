@@ -1,15 +1,27 @@
+import asyncio
 import functools
+from collections.abc import AsyncIterator
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain_core.prompts import PromptTemplate
 from langchain.memory import ConversationBufferWindowMemory
+from langchain_core.messages import HumanMessage, SystemMessage, get_buffer_string
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.tools import Tool
 from google.genai.types import File
+from pydantic import PrivateAttr
 
 from src.tools import (
     generate_summary_tool,
     detect_revenue_trends_tool,
-    highlight_key_financial_metrics_tool
+    highlight_key_financial_metrics_tool,
+    full_report_analysis_tool,
+    generate_summary_tool_async,
+    detect_revenue_trends_tool_async,
+    highlight_key_financial_metrics_tool_async,
+    full_report_analysis_tool_async,
+    FAST_MODEL_TOOLS,
+    TEXT_TOOLS,
+    stream_tool_async
 )
 
 # Basic prompt template for the ReAct agent
@@ -40,12 +52,59 @@ New input: {input}
 {agent_scratchpad}
 """
 
+# System prompt for the single-shot tool router that runs before the ReAct agent
+ROUTER_PROMPT_TEMPLATE = """
+You route questions about the financial document '{display_name}' to analysis tools.
+If the tools answer the question, call them with self-contained queries
+(resolve references such as "it" or "that" using the conversation history).
+Independent parts of a question may be sent to several tools at once.
+If the question needs several dependent steps, or none of the tools fit, reply without calling a tool.
+
+Previous conversation history:
+{chat_history}
+"""
+
+# Parsed once at import; create_react_agent fills {tools} and {tool_names} as partials when the agent is built
+_BASE_PROMPT = PromptTemplate.from_template(REACT_PROMPT_TEMPLATE)
+
+# Final output of AgentExecutor when it gives up at max_iterations (early_stopping_method="force")
+AGENT_STOPPED_OUTPUT = "Agent stopped due to iteration limit or time limit."
+
+
+class CachedWindowMemory(ConversationBufferWindowMemory):
+    """
+    Window memory that formats the chat history string once per new turn.
+    The formatted string is reused until the messages in the window change.
+    """
+    _history_key: tuple = PrivateAttr(default=())
+    _history_str: str = PrivateAttr(default="")
+
+    def load_memory_variables(self, inputs: dict) -> dict:
+        messages = self.chat_memory.messages[-self.k * 2:] if self.k > 0 else []
+        history_key = tuple(id(m) for m in messages)
+        if history_key != self._history_key:
+            self._history_str = get_buffer_string(
+                messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+            )
+            self._history_key = history_key
+        return {self.memory_key: self._history_str}
+
+
+def _llm_for_tool(tool_name: str, llm: ChatGoogleGenerativeAI,
+                  fast_llm: ChatGoogleGenerativeAI | None) -> ChatGoogleGenerativeAI:
+    """
+    Returns the model a tool runs on: the fast model for FAST_MODEL_TOOLS when one is given, else the main model.
+    """
+    return fast_llm if fast_llm is not None and tool_name in FAST_MODEL_TOOLS else llm
+
 
 # Create agent
 # The file_details dict will contain: {"uri": str, "mime_type": str, "display_name": str}
-def create_financial_agent(llm: ChatGoogleGenerativeAI, file_context: dict):
+def create_financial_agent(llm: ChatGoogleGenerativeAI, file_context: dict,
+                           fast_llm: ChatGoogleGenerativeAI | None = None):
     """
     Create a conversational financial agent using an uploaded Gemini File Object.
+    The agent itself reasons with llm; extraction-style tools run on fast_llm if given.
     """
     print(f"Agent created to analyze: {file_context['display_name']} (URI: {file_context['file'].uri})")
 
@@ -56,47 +115,70 @@ def create_financial_agent(llm: ChatGoogleGenerativeAI, file_context: dict):
     # decorated function's name and docstring by default if using @tool.
     # If manually creating Tool objects, need specify them.
     # Since @tool have comprehensive docstrings, these will serve as desc.
+    revenue_llm = _llm_for_tool("RevenueTrendAnalysis", llm, fast_llm)
+    metrics_llm = _llm_for_tool("KeyFinancialMetricsExtraction", llm, fast_llm)
     summary_tool_with_context = functools.partial(
         generate_summary_tool, llm=llm, file_context=file_context
     )
     revenue_tool_with_context = functools.partial(
-        detect_revenue_trends_tool, llm=llm, file_context=file_context
+        detect_revenue_trends_tool, llm=revenue_llm, file_context=file_context
     )
     metrics_tool_with_context = functools.partial(
-        highlight_key_financial_metrics_tool, llm=llm, file_context=file_context
+        highlight_key_financial_metrics_tool, llm=metrics_llm, file_context=file_context
+    )
+    full_analysis_tool_with_context = functools.partial(
+        full_report_analysis_tool, llm=llm, file_context=file_context
     )
 
+    # Async variants, used by astream() and the router so tool calls don't block the event loop
+    summary_coroutine = functools.partial(generate_summary_tool_async, llm=llm, file_context=file_context)
+    revenue_coroutine = functools.partial(detect_revenue_trends_tool_async, llm=revenue_llm, file_context=file_context)
+    metrics_coroutine = functools.partial(highlight_key_financial_metrics_tool_async, llm=metrics_llm, file_context=file_context)
+    full_analysis_coroutine = functools.partial(full_report_analysis_tool_async, llm=llm, file_context=file_context)
+
     # Create LangChain Tool Objects
     # The agent will see original docstring of the decorated functions as their description
+    # metadata["llm"] records the model each tool runs on, for callers that run the tool's work directly
     tools = [
         Tool(
             name="FinancialSummary",    # Name the agent will use
             func=summary_tool_with_context,   # The partially filled function
-            description=generate_summary_tool.__doc__  # Explicitly pass docstring
+            coroutine=summary_coroutine,
+            description=generate_summary_tool.__doc__,  # Explicitly pass docstring
+            metadata={"llm": llm}
         ),
         Tool(
             name="RevenueTrendAnalysis",
             func=revenue_tool_with_context,
-            description=detect_revenue_trends_tool.__doc__
+            coroutine=revenue_coroutine,
+            description=detect_revenue_trends_tool.__doc__,
+            metadata={"llm": revenue_llm}
         ),
         Tool(
             name="KeyFinancialMetricsExtraction",
             func=metrics_tool_with_context,
-            description=highlight_key_financial_metrics_tool.__doc__
+            coroutine=metrics_coroutine,
+            description=highlight_key_financial_metrics_tool.__doc__,
+            metadata={"llm": metrics_llm}
+        ),
+        Tool(
+            name="FullReportAnalysis",
+            func=full_analysis_tool_with_context,
+            coroutine=full_analysis_coroutine,
+            description=full_report_analysis_tool.__doc__,
+            metadata={"llm": llm}
         )
     ]
 
-    prompt = PromptTemplate.from_template(REACT_PROMPT_TEMPLATE)
-
-    memory = ConversationBufferWindowMemory(
+    # The ReAct prompt is a plain string template, so history is provided as a formatted string
+    memory = CachedWindowMemory(
         k=5,
         memory_key="chat_history",
         input_key="input",
-        return_messages=True,
         output_key="output"
     )
 
-    agent = create_react_agent(llm=llm, tools=tools, prompt=prompt)
+    agent = create_react_agent(llm=llm, tools=tools, prompt=_BASE_PROMPT)
 
     agent_executor = AgentExecutor(
         agent=agent,
@@ -110,3 +192,99 @@ def create_financial_agent(llm: ChatGoogleGenerativeAI, file_context: dict):
 
     print("Financial agent (multimodal via File API) created successfully.")
     return agent_executor
+
+
+def _tool_declaration(tool: Tool) -> dict:
+    """
+    Describes a single-input Tool as a function declaration for Gemini native function calling.
+    """
+    return {
+        "name": tool.name,
+        "description": tool.description,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "The question to pass to the tool."}
+            },
+            "required": ["query"]
+        }
+    }
+
+
+async def gather_tools(tool_calls: list[tuple[Tool, str]]) -> list[str]:
+    """
+    Runs several (tool, query) pairs concurrently and returns their outputs in order.
+    The tools' async variants bound the number of in-flight LLM requests.
+    """
+    return await asyncio.gather(*(tool.ainvoke(tool_query) for tool, tool_query in tool_calls))
+
+
+class ToolRouter:
+    """
+    Single-shot fast path in front of the ReAct agent.
+    One function-calling request picks the tools, which are then run directly (concurrently
+    when there are several) without the ReAct planning loop.
+    A single call to a plain-text tool is streamed chunk by chunk, on the model recorded in the tool's metadata.
+    Returns None when the question should go to the full agent.
+    """
+
+    def __init__(self, llm: ChatGoogleGenerativeAI, agent_executor: AgentExecutor, file_context: dict):
+        self.tools_by_name = {tool.name: tool for tool in agent_executor.tools}
+        self.memory = agent_executor.memory
+        self.display_name = file_context["display_name"]
+        self.file_context = file_context
+        self.tool_llm = llm.bind_tools([_tool_declaration(tool) for tool in agent_executor.tools])
+
+    async def aroute(self, query: str) -> AsyncIterator[str] | None:
+        """
+        Picks the tools for the query. Returns an async iterator over the answer's chunks,
+        or None when the question should go to the full agent.
+        """
+        chat_history = self.memory.load_memory_variables({})[self.memory.memory_key]
+        messages = [
+            SystemMessage(content=ROUTER_PROMPT_TEMPLATE.format(
+                display_name=self.display_name, chat_history=chat_history
+            )),
+            HumanMessage(content=query)
+        ]
+        try:
+            response = await self.tool_llm.ainvoke(messages)
+        except Exception as e:
+            print(f"\n[Router] Falling back to the full agent: {e}")
+            return None
+
+        if not response.tool_calls:
+            return None
+        tool_calls = []
+        for tool_call in response.tool_calls:
+            tool = self.tools_by_name.get(tool_call["name"])
+            if tool is None:
+                return None
+            tool_calls.append((tool, tool_call["args"].get("query") or query))
+
+        if len(tool_calls) == 1 and tool_calls[0][0].name in TEXT_TOOLS:
+            tool, tool_query = tool_calls[0]
+            chunks = stream_tool_async(tool.name, tool_query, self.file_context, tool.metadata["llm"])
+        else:
+            chunks = self._gather_chunks(tool_calls)
+        return self._remember(query, chunks)
+
+    async def _gather_chunks(self, tool_calls: list[tuple[Tool, str]]) -> AsyncIterator[str]:
+        yield "\n\n".join(await gather_tools(tool_calls))
+
+    async def _remember(self, query: str, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """
+        Passes the chunks through, then records the turn so the ReAct agent sees it in its history later.
+        """
+        output_parts: list[str] = []
+        async for chunk in chunks:
+            output_parts.append(chunk)
+            yield chunk
+        self.memory.save_context({"input": query}, {"output": "".join(output_parts)})
+
+
+def create_tool_router(llm: ChatGoogleGenerativeAI, agent_executor: AgentExecutor, file_context: dict) -> ToolRouter:
+    """
+    Create the function-calling fast path that shares tools, their models and memory with the agent.
+    """
+    return ToolRouter(llm, agent_executor, file_context)
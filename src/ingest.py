@@ -0,0 +1,69 @@
+import gc
+import os
+
+from google.genai.types import File, FileState
+
+from src.utils import get_genai_client, load_json_cache, save_json_cache
+
+# Necessary Parameters
+UPLOAD_CACHE_PATH = os.path.join(".cache", "gemini_files.json")   # Previous uploads, for reuse across runs
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024   # Read buffer for streaming PDF uploads
+
+# Content digest -> File uploaded in this session
+_SESSION_UPLOADS: dict[str, File] = {}
+
+
+# Reuse a previous upload of the same PDF content
+def get_cached_upload(pdf_digest: str) -> File | None:
+    """
+    Returns the Gemini File object recorded for pdf_digest if it is still ACTIVE on the server.
+    """
+    entry = load_json_cache(UPLOAD_CACHE_PATH).get(pdf_digest)
+    if not entry:
+        return None
+    try:
+        pdf_file = get_genai_client().files.get(name=entry["name"])
+    except Exception:
+        return None   # Expired or deleted on the server side
+    return pdf_file if pdf_file.state == FileState.ACTIVE else None
+
+
+# Upload PDF file to Gemini
+def upload_pdf_streaming(pdf_path: str, display_name: str, pdf_digest: str) -> File | None:
+    """
+    Uploads the PDF file to Gemini and returns File object.
+    The file is streamed from disk in UPLOAD_CHUNK_SIZE reads and never loaded whole, so memory
+    stays bounded regardless of the report's size.
+    The same content (SHA-256 digest) is uploaded only once per session, and an earlier upload
+    that is still available on the server is reused.
+    """
+    pdf_file = _SESSION_UPLOADS.get(pdf_digest)
+    if pdf_file:
+        return pdf_file
+
+    pdf_file = get_cached_upload(pdf_digest)
+    if pdf_file:
+        print(f"\nReusing previously uploaded '{display_name}'. URI: {pdf_file.uri}")
+        _SESSION_UPLOADS[pdf_digest] = pdf_file
+        return pdf_file
+
+    print(f"\nUploading '{display_name}' to Gemini... This may take a moment.")
+    try:
+        # Pass an open handle so the SDK's resumable upload reads the file chunk by chunk
+        with open(pdf_path, "rb", buffering=UPLOAD_CHUNK_SIZE) as pdf_handle:
+            pdf_file = get_genai_client().files.upload(
+                file=pdf_handle,
+                config={"mime_type": "application/pdf", "display_name": display_name}
+            )
+        print(f"File uploaded successfully. URI: {pdf_file.uri}")
+        upload_cache = load_json_cache(UPLOAD_CACHE_PATH)
+        upload_cache[pdf_digest] = {"name": pdf_file.name, "uri": pdf_file.uri}
+        save_json_cache(UPLOAD_CACHE_PATH, upload_cache)
+        _SESSION_UPLOADS[pdf_digest] = pdf_file
+        return pdf_file
+    except Exception as e:
+        print(f"Error uploading PDF to Gemini: {e}")
+        print("Please check API key permissions for file uploading and network connection.")
+        return None
+    finally:
+        gc.collect()   # Release the upload's chunk buffers before the session starts
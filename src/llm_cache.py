@@ -0,0 +1,211 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+logger = logging.getLogger(__name__)
+
+# Necessary Parameters
+EMBEDDING_MODEL_NAME = "models/text-embedding-004"
+EMBED_MAX_FAILURES = 3   # Consecutive embedding failures before the semantic tier is turned off for the session
+CACHE_DIR = ".cache"
+RESPONSE_CACHE_PATH = os.path.join(CACHE_DIR, "responses.json")
+
+
+def cache_key(document_id: str, query: str, model: str) -> str:
+    """
+    Builds the exact-match key for a query asked about a given document (its content digest).
+    """
+    payload = json.dumps({"doc": document_id, "q": query, "model": model}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _valid_entry(entry) -> bool:
+    """
+    Checks the shape of an entry read from disk.
+    """
+    if not isinstance(entry, dict):
+        return False
+    if not isinstance(entry.get("scope"), str) or not isinstance(entry.get("response"), str):
+        return False
+    if not isinstance(entry.get("created_at", 0), (int, float)):
+        return False
+    embedding = entry.get("embedding")
+    if embedding is None:
+        entry["embedding"] = None
+        return True
+    return (isinstance(embedding, list) and len(embedding) > 0
+            and all(isinstance(x, (int, float)) for x in embedding))
+
+
+class LLMCache:
+    """
+    Two-tier cache for final agent responses.
+    Tier 1 is an exact lookup on the hashed (document, query, model) key.
+    Tier 2 compares the query embedding against previously answered queries on the
+    same document and reuses the stored answer when the cosine similarity is high enough.
+    Entries are evicted least-recently-used first, optionally expire after ttl_seconds,
+    and are persisted between sessions unless path is None.
+    Safe to share between threads; the lock is not held while a query is being embedded.
+    """
+
+    def __init__(self, google_api_key: str, maxsize: int = 512, threshold: float = 0.92,
+                 path: str | None = RESPONSE_CACHE_PATH, ttl_seconds: float | None = None):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._google_api_key = google_api_key
+        self._embeddings = None
+        self._embed_failures = 0
+        # key -> {"scope": str, "response": str, "embedding": list[float] | None, "created_at": float}
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        # Embedding matrix per scope, rebuilt lazily after the entries change
+        self._matrices: dict[str, tuple[list[str], np.ndarray]] = {}
+        # Reentrant: get_similar holds it while calling _matrix_for and get_exact
+        self._lock = threading.RLock()
+        self.load()
+
+    def embed(self, query: str) -> np.ndarray | None:
+        """
+        Returns the L2-normalised embedding of the query, or None if embedding fails.
+        After EMBED_MAX_FAILURES failures in a row, returns None without trying, so a bad key or an
+        unavailable model does not cost a failing request on every lookup.
+        """
+        if self._embed_failures >= EMBED_MAX_FAILURES:
+            return None
+        try:
+            if self._embeddings is None:
+                self._embeddings = GoogleGenerativeAIEmbeddings(
+                    model=EMBEDDING_MODEL_NAME,
+                    google_api_key=self._google_api_key
+                )
+            vector = np.asarray(self._embeddings.embed_query(query), dtype=np.float32)
+        except Exception as e:
+            with self._lock:
+                self._embed_failures += 1
+                disabled = self._embed_failures >= EMBED_MAX_FAILURES
+            logger.warning("Could not embed query, semantic lookup skipped%s: %s",
+                           " for the rest of the session" if disabled else "", e)
+            return None
+        self._embed_failures = 0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def get_exact(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl_seconds is not None and time.time() - entry.get("created_at", 0) > self.ttl_seconds:
+                del self._entries[key]
+                self._matrices.pop(entry["scope"], None)
+                return None
+            self._entries.move_to_end(key)
+            return entry["response"]
+
+    def get_similar(self, embedding: np.ndarray | None, scope: str) -> str | None:
+        """
+        Returns the stored response whose query is most similar to the given embedding,
+        provided it was asked about the same document (scope) and clears the threshold.
+        """
+        if embedding is None:
+            return None
+        with self._lock:
+            keys, matrix = self._matrix_for(scope)
+            if not keys:
+                return None
+            if matrix.shape[1] != embedding.shape[0]:
+                return None   # Stored vectors come from a different embedding model
+            similarities = embedding @ matrix.T
+            best = int(np.argmax(similarities))
+            if similarities[best] <= self.threshold:
+                return None
+            return self.get_exact(keys[best])
+
+    def lookup(self, key: str, query: str, scope: str) -> tuple[str | None, np.ndarray | None]:
+        """
+        Tries the exact tier, then the semantic tier.
+        Returns the cached response (or None) and the query embedding, which callers
+        pass back to set() on a miss so the query is embedded only once.
+        """
+        response = self.get_exact(key)
+        if response is not None:
+            return response, None
+        embedding = self.embed(query)
+        return self.get_similar(embedding, scope), embedding
+
+    def set(self, key: str, response: str, embedding: np.ndarray | None, scope: str):
+        entry = {
+            "scope": scope,
+            "response": response,
+            "embedding": embedding.tolist() if embedding is not None else None,
+            "created_at": time.time()
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                _, evicted = self._entries.popitem(last=False)
+                self._matrices.pop(evicted["scope"], None)
+            self._matrices.pop(scope, None)
+
+    def _matrix_for(self, scope: str) -> tuple[list[str], np.ndarray]:
+        with self._lock:
+            if scope not in self._matrices:
+                keys = [k for k, e in self._entries.items() if e["scope"] == scope and e["embedding"] is not None]
+                rows = [self._entries[k]["embedding"] for k in keys]
+                matrix = np.asarray(rows, dtype=np.float32) if rows else np.empty((0, 0), dtype=np.float32)
+                self._matrices[scope] = (keys, matrix)
+            return self._matrices[scope]
+
+    def load(self):
+        """
+        Loads persisted entries from disk. A missing or unreadable file leaves the cache empty.
+        Entries embedded with a different model than EMBEDDING_MODEL_NAME, or malformed ones, are skipped.
+        """
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[Cache] Could not read response cache '{self.path}': {e}")
+            return
+        if not isinstance(data, dict) or not isinstance(data.get("entries"), dict):
+            print(f"[Cache] Ignoring response cache '{self.path}': unrecognised format.")
+            return
+        if data.get("embedding_model") != EMBEDDING_MODEL_NAME:
+            print(f"[Cache] Ignoring response cache '{self.path}': built with another embedding model.")
+            return
+        dimension = None
+        with self._lock:
+            for key, entry in list(data["entries"].items())[-self.maxsize:]:
+                if not _valid_entry(entry):
+                    continue
+                if entry["embedding"] is not None:
+                    dimension = dimension or len(entry["embedding"])
+                    if len(entry["embedding"]) != dimension:
+                        continue
+                self._entries[key] = entry
+
+    def save(self):
+        """
+        Persists the cache to disk so answers survive between sessions.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            data = {"embedding_model": EMBEDDING_MODEL_NAME, "entries": dict(self._entries)}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        except OSError as e:
+            print(f"[Cache] Could not write response cache '{self.path}': {e}")
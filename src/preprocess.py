@@ -0,0 +1,101 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_google_genai import ChatGoogleGenerativeAI
+from pydantic import BaseModel, Field
+
+from src.tools import _llm_call, _record_usage
+from src.utils import load_json_cache, save_json_cache
+
+logger = logging.getLogger(__name__)
+
+# Necessary Parameters
+FACTS_CACHE_DIR = os.path.join(".cache", "facts")   # One JSON file per document digest
+FACTS_USAGE_KEY = "FactsExtraction"   # Token usage of the extraction call, reported with the tools' usage
+
+FACTS_SYSTEM_INSTRUCTION = (
+    "You are a financial data extraction specialist. The attached PDF file is a financial report. "
+    "Use ALL of its content, including text, tables, and any visual information like charts if discernible."
+)
+
+FACTS_EXTRACTION_PROMPT = """
+    Extract every figure a financial analyst would need from this report into a compact facts table.
+    Keep the exact values, units and periods as reported, and include comparisons to previous periods
+    whenever the report gives them. Do not add commentary or anything that is not in the report.
+
+    Respond with a JSON object with exactly these keys:
+    - "company": the company name.
+    - "period": the reporting period covered, e.g. "Q1 2024".
+    - "revenue": a list of strings, one per reported revenue figure, with its period and comparison.
+    - "segments": a list of strings, one per business segment or region result.
+    - "metrics": an object mapping each key financial metric (net income, EPS basic and diluted, gross and
+      operating margin, operating expenses, cash flow from operations, free cash flow, total assets,
+      total liabilities, shareholders' equity, ...) to its value and period as a string.
+    - "drivers": a list of strings, one per stated reason for the results, including outlook or guidance.
+    """
+
+
+class FinancialFacts(BaseModel):
+    """
+    Compact table of the figures in a financial report, extracted once per document.
+    """
+    company: str = Field(description="Company name.")
+    period: str = Field(description="Reporting period covered by the report.")
+    revenue: list[str] = Field(description="Reported revenue figures with their periods and comparisons.")
+    segments: list[str] = Field(description="Results per business segment or region.")
+    metrics: dict[str, str] = Field(description="Key financial metrics mapped to their value and period.")
+    drivers: list[str] = Field(description="Stated drivers of the results, outlook and guidance.")
+
+
+_FACTS_PARSER = PydanticOutputParser(pydantic_object=FinancialFacts)
+
+# Changes whenever the prompt or schema does, so tables extracted by an older version are not reused
+FACTS_SCHEMA_VERSION = hashlib.sha256(
+    (FACTS_EXTRACTION_PROMPT + json.dumps(FinancialFacts.model_json_schema(), sort_keys=True)).encode("utf-8")
+).hexdigest()[:12]
+
+
+def extract_financial_facts(llm: ChatGoogleGenerativeAI, file_context: dict) -> str | None:
+    """
+    Condenses the uploaded report into a JSON facts table with one LLM call, for the
+    extraction-style tools to use instead of the full document.
+    The table is cached on disk by the document's content digest and FACTS_SCHEMA_VERSION, so each
+    report is processed only once per version of the prompt and schema.
+    Returns the table as JSON text, or None if extraction fails (the tools then read the full document).
+    """
+    digest = file_context["digest"]
+    facts_path = os.path.join(FACTS_CACHE_DIR, f"{digest}.{FACTS_SCHEMA_VERSION}.json")
+    facts = load_json_cache(facts_path)
+    if not facts:
+        gemini_file_object = file_context["file"]
+        messages = [
+            SystemMessage(content=FACTS_SYSTEM_INSTRUCTION),
+            HumanMessage(
+                content=[
+                    {"type": "media", "file_uri": gemini_file_object.uri, "mime_type": gemini_file_object.mime_type},
+                    FACTS_EXTRACTION_PROMPT
+                ]
+            )
+        ]
+        try:
+            json_llm = llm.bind(generation_config={"response_mime_type": "application/json"})
+            response = _llm_call(json_llm, messages)
+            _record_usage(FACTS_USAGE_KEY, response.usage_metadata)
+            facts = _FACTS_PARSER.invoke(response).model_dump()
+        except Exception as e:
+            # Runs in the background while the user types, so this goes to the log rather than stdout
+            logger.warning("Could not extract financial facts, tools will read the full report: %s", e)
+            return None
+        # Drop tables extracted for this document by older versions
+        for stale_path in glob.glob(os.path.join(FACTS_CACHE_DIR, f"{digest}*.json")):
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
+        save_json_cache(facts_path, facts)
+    return json.dumps(facts, ensure_ascii=False)
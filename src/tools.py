@@ -1,21 +1,51 @@
+import asyncio
+import functools
+import json
+import logging
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from datetime import datetime, timezone
+
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, SystemMessage
-from google.genai.types import File  # For Type Hinting
+from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.runnables import Runnable
+from google.api_core.exceptions import GoogleAPIError, ResourceExhausted, ServiceUnavailable
+from google.genai.errors import ClientError
+from google.genai.types import CachedContent, CreateCachedContentConfig, File, Part  # For Type Hinting
+import numpy as np
+from pydantic import BaseModel, Field
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
-# file_details: dict containing {"uri": str, "mime_type": str, "display_name": str}
+from src.llm_cache import LLMCache, cache_key
+from src.utils import get_genai_client
 
-# @tool
-def generate_summary_tool(query: str, file_context: dict, llm: ChatGoogleGenerativeAI) -> str:
-    """
-    Generates a concise summary of the provided financial document (PDF via File API).
-    The input 'query' can be a general request for summary, e.g., 'summarize the report'.
-    This tool analyzes the entire document content, including text and visual elements from the uploaded PDF.
-    """
-    gemini_file_object = file_context["file"]
-    display_name = file_context["display_name"]
-    print(f"\n>> Using Generate Summary Tool for query: '{query}' on file: {display_name}")
+logger = logging.getLogger(__name__)
 
-    prompt_text = f"""
+# file_context: dict containing {"file": File, "display_name": str, "digest": str}
+# and, once extracted, "facts": str (JSON facts table, see src/preprocess.py)
+
+# Gemini context caching: the uploaded document is cached once and reused by every tool call
+CONTEXT_CACHE_TTL_SECONDS = 3600
+CONTEXT_CACHE_MAX_ENTRIES = 8
+DOCUMENT_SYSTEM_INSTRUCTION = (
+    "You are a highly skilled financial analyst AI. The attached PDF file is the financial report to analyze. "
+    "Use ALL of its content, including text, tables, and any visual information like charts if discernible."
+)
+
+# Tool roles. These are sent after the document, so the document prefix is shared by all tools
+SYSTEM_SUMMARY = "You are an AI assistant specialized in summarizing financial reports from uploaded PDF files (including images)."
+SYSTEM_REVENUE = "You are an AI assistant focused on identifying and explaining revenue trends from all content in uploaded PDF files."
+SYSTEM_METRICS = "You are an AI assistant for extracting key financial metrics from all content in uploaded PDF files."
+SYSTEM_FULL_ANALYSIS = "You are an AI assistant that produces a complete financial analysis of uploaded PDF files in one pass."
+
+# Prompt skeletons, built once at import. Each prompt is sent as two parts: the instructions,
+# formatted once per document and shared by every call, and a short per-call part carrying the query.
+# The query part goes last, keeping the instruction text byte-identical.
+_SUMMARY_INSTRUCTIONS_TMPL = """
     You are a highly skilled financial analyst AI.
     Please analyze the entire financial report document provided via its File API URI.
     The document is: {display_name}.
@@ -24,41 +54,13 @@ def generate_summary_tool(query: str, file_context: dict, llm: ChatGoogleGenerat
     in this document, provide a concise executive summary highlighting the absolute key financial results,
     main achievements, and overall company performance. Focus on the most critical information.
 
-    User's specific request regarding summary: "{query}"
-
-    Concise Executive Summary:
     """
+_SUMMARY_QUERY_TMPL = """    User's specific request regarding summary: "{query}"
 
-    try:
-        messages = [
-            SystemMessage(content="You are an AI assistant specialized in summarizing financial reports from uploaded PDF files (including images)."),
-            HumanMessage(
-                content=[
-                    #gemini_file_object,
-                    prompt_text
-                ]
-            )
-        ]
-        response = llm.invoke(messages)
-        return response.content
-    except Exception as e:
-        return f"Error in Generate Summary Tool: {str(e)}"
-    
-
-#@tool
-def detect_revenue_trends_tool(query: str, file_context: dict, llm: ChatGoogleGenerativeAI) -> str:
-    """
-    Analyzes the financial document (PDF via File API) to identify and describe revenue trends.
-    The input 'query' should be a question about revenue, e.g., 'What are the revenue
-    trends?' or 'How did revenue change?'
-    This tool considers all content, including tables and charts that might show revenue data.
+    Concise Executive Summary:
     """
-    gemini_file_object = file_context["file"]
-    display_name = file_context["display_name"]
-    
-    print(f"\n>> Using Detect Revenue Trends Tool for query: '{query}' on file: {display_name}")
 
-    prompt_text = f"""
+_REVENUE_INSTRUCTIONS_TMPL = """
     You are a specialist in financial trend analysis.
     The financial report to analyze is: {display_name}.
 
@@ -69,39 +71,13 @@ def detect_revenue_trends_tool(query: str, file_context: dict, llm: ChatGoogleGe
     3. Any stated reasons or drivers for these revenue trends, potentially inferred from text or visuals.
     4. Overall revenue performance (e.g., strong growth, stable, decline).
 
-    User's specific query about revenue: "{query}"
-
-    Detailed Revenue Trend Analysis (considering all document content):
     """
-    try:
-        messages = [
-            SystemMessage(content=f"You are an AI assistant focused on identifying and explaining revenue trends from all content in uploaded PDF files."),
-            HumanMessage(
-                content=[
-                    #gemini_file_object,
-                    prompt_text
-                ])
-        ]
-        response = llm.invoke(messages)
-        return response.content
-    except Exception as e:
-        return f"Error in Detect Revenue Trends Tool: {str(e)}"
-    
+_REVENUE_QUERY_TMPL = """    User's specific query about revenue: "{query}"
 
-#@tool
-def highlight_key_financial_metrics_tool(query: str, file_context: dict, llm: ChatGoogleGenerativeAI) -> str:
-    """
-    Extracts and lists key financial metrics from the document (PDF via File API).
-    The input 'query' should be a request for key metrics, e.g., 'What are the key financial metrics?' or 'List important financial figures'.
-    This tool identifies metrics like Net Income, EPS, Profit Margins, Operating Expenses, Cash Flow, etc., with their values,
-    by analyzing all content, including numbers that might be in tables or charts.
+    Detailed Revenue Trend Analysis (considering all document content):
     """
-    gemini_file_object = file_context["file"]
-    display_name = file_context["display_name"]
-    
-    print(f"\n>> Using Highlight Key Financial Metrics Tool for query: '{query}' on file: {display_name}")
 
-    prompt_text = f"""
+_METRICS_INSTRUCTIONS_TMPL = """
     As a financial data extraction specialist, your task is to identify and list key financial metrics
     from the provided financial report: {display_name}.
     Analyze ALL content (text, tables, charts if discernible). For each metric, provide its value and the period.
@@ -118,20 +94,768 @@ def highlight_key_financial_metrics_tool(query: str, file_context: dict, llm: Ch
     - Shareholders' Equity
     - Key Segment Performance Metrics (if any are prominent)
 
-    User's specific query about metrics: "{query}"
+    """
+_METRICS_QUERY_TMPL = """    User's specific query about metrics: "{query}"
 
     List of Key Financial Metrics (from all document content):
     """
+
+_FULL_ANALYSIS_INSTRUCTIONS_TMPL = """
+    Analyze the financial report {display_name} using ALL of its content (text, tables, charts if discernible)
+    and fill in three sections:
+    - summary: a concise executive summary of the key financial results, main achievements and overall performance.
+    - revenue_trends: specific revenue figures, comparisons to previous periods, stated drivers and overall revenue performance.
+    - key_metrics: key financial metrics (revenue, net income, EPS, margins, operating expenses, cash flow,
+      free cash flow, assets, liabilities, equity, prominent segment metrics) with their values and periods.
+    Respond with a JSON object with exactly the keys "summary", "revenue_trends" and "key_metrics", each a string.
+
+    """
+_FULL_ANALYSIS_QUERY_TMPL = """    User's specific request: "{query}"
+    """
+
+# Plain-text tools: name -> (label used in messages, tool role, instructions, query part).
+# The summary, revenue and metrics tools and the streaming path are all built from this table.
+TEXT_TOOLS = {
+    "FinancialSummary": ("Generate Summary", SYSTEM_SUMMARY, _SUMMARY_INSTRUCTIONS_TMPL, _SUMMARY_QUERY_TMPL),
+    "RevenueTrendAnalysis": ("Detect Revenue Trends", SYSTEM_REVENUE, _REVENUE_INSTRUCTIONS_TMPL, _REVENUE_QUERY_TMPL),
+    "KeyFinancialMetricsExtraction": (
+        "Highlight Key Financial Metrics", SYSTEM_METRICS, _METRICS_INSTRUCTIONS_TMPL, _METRICS_QUERY_TMPL
+    ),
+}
+
+# Shared system message for requests that send the file reference instead of using the context cache
+_DOCUMENT_SYSTEM_MESSAGE = SystemMessage(content=DOCUMENT_SYSTEM_INSTRUCTION)
+
+# Tools answered from the pre-extracted facts table (file_context["facts"]) when it is available.
+# The table is a few kilobytes of JSON, so these requests skip the document prefill entirely.
+FACTS_TOOLS = {"RevenueTrendAnalysis", "KeyFinancialMetricsExtraction"}
+# Extraction-style tools, run on the smaller and faster model when one is configured.
+# The same tools as FACTS_TOOLS: looking figures up in the facts table does not need the larger model.
+FAST_MODEL_TOOLS = FACTS_TOOLS
+_FACTS_SYSTEM_MESSAGE = SystemMessage(content=(
+    "You are a highly skilled financial analyst AI. The financial report has been condensed into the JSON facts "
+    "table below, which lists its reported figures, periods and stated drivers. Treat it as the document."
+))
+
+# (File URI, model) -> (cached content, LLM bound to it), least recently used first.
+# Context caches are tied to the model that created them, so each model gets its own.
+_CACHE: OrderedDict[tuple[str, str], tuple[CachedContent, ChatGoogleGenerativeAI]] = OrderedDict()
+_UNCACHEABLE: set[tuple[str, str]] = set()   # Keys Gemini refused to cache (e.g. below the minimum token count)
+_CACHE_LOCK = threading.Lock()   # Tools may run concurrently; create each cache only once
+
+# In-process cache of tool answers: exact (tool, document, query) match, then similar queries
+TOOL_CACHE_TTL_SECONDS = 3600
+_TOOL_RESPONSE_CACHE: LLMCache | None = None
+
+# Cache hit counters: "hits" and "prefill_tokens_saved" (document tokens not sent to the model)
+CACHE_STATS: Counter[str] = Counter()
+_DOCUMENT_TOKEN_COUNTS: dict[str, int | None] = {}   # Document digest -> token count, counted once
+_TOKEN_COUNT_LOCK = threading.Lock()   # Count each document only once
+
+# Token usage per tool, for cost and cache-effectiveness monitoring: "calls", "input", "output" and
+# "cache_read" (input tokens served from the context cache). Context cache creation is counted
+# under CONTEXT_CACHE_USAGE_KEY as "cache_write". A falling cache_read share means the prompt
+# prefix stopped being cacheable.
+TOKEN_USAGE: defaultdict[str, Counter[str]] = defaultdict(Counter)
+CONTEXT_CACHE_USAGE_KEY = "ContextCache"
+_STATS_LOCK = threading.Lock()   # Tools update CACHE_STATS and TOKEN_USAGE from several threads at once
+
+# Failed tool calls per tool label. The tools report failures to the agent as text, so callers
+# compare this before and after a turn to tell whether the answer is built on an error.
+TOOL_ERRORS: Counter[str] = Counter()
+
+# Upper bound on concurrent LLM requests from async tools, to stay within Gemini rate limits
+MAX_CONCURRENT_LLM_CALLS = 8
+_LLM_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+
+# Transient Gemini errors (rate limit, overload) are retried with jittered exponential backoff.
+# Other provider errors are reported by the tools; anything else is a bug and propagates.
+LLM_RETRY_ATTEMPTS = 4
+_RETRYABLE_ERRORS = (ResourceExhausted, ServiceUnavailable)
+_PROVIDER_ERRORS = (GoogleAPIError, ChatGoogleGenerativeAIError, OutputParserException)
+_llm_retry = retry(
+    reraise=True,
+    stop=stop_after_attempt(LLM_RETRY_ATTEMPTS),
+    wait=wait_random_exponential(multiplier=0.5, max=8),
+    retry=retry_if_exception_type(_RETRYABLE_ERRORS)
+)
+
+
+def _delete_context_cache(cached_content: CachedContent):
+    try:
+        get_genai_client().caches.delete(name=cached_content.name)
+    except Exception:
+        pass   # Already expired or deleted on the server side
+
+
+def _get_cached_llm(llm: ChatGoogleGenerativeAI, file_context: dict) -> ChatGoogleGenerativeAI | None:
+    """
+    Returns an LLM bound to a Gemini context cache holding the uploaded document,
+    creating the cache on first use. Returns None if the document cannot be cached.
+    """
+    with _CACHE_LOCK:
+        gemini_file_object = file_context["file"]
+        key = (gemini_file_object.uri, llm.model)
+        if key in _UNCACHEABLE:
+            return None
+
+        entry = _CACHE.get(key)
+        if entry is not None:
+            cached_content, cached_llm = entry
+            if cached_content.expire_time and cached_content.expire_time > datetime.now(timezone.utc):
+                _CACHE.move_to_end(key)
+                return cached_llm
+            # TTL expired: drop it and create a fresh cache below
+            del _CACHE[key]
+            _delete_context_cache(cached_content)
+
+        try:
+            cached_content = get_genai_client().caches.create(
+                model=llm.model,
+                config=CreateCachedContentConfig(
+                    contents=[gemini_file_object],
+                    system_instruction=DOCUMENT_SYSTEM_INSTRUCTION,
+                    display_name=file_context["display_name"],
+                    ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s"
+                )
+            )
+        except Exception as e:
+            # Only a permanent rejection (e.g. too few tokens, model without caching) disables caching for
+            # the document; rate limits, server and network errors fall back for this call and retry later
+            permanent = isinstance(e, ClientError) and e.code != 429
+            logger.warning(
+                "Context caching %s for %s, sending the file with %s: %s",
+                "unavailable" if permanent else "failed",
+                file_context["display_name"],
+                "each request" if permanent else "this request",
+                e
+            )
+            if permanent:
+                _UNCACHEABLE.add(key)
+            return None
+
+        if cached_content.usage_metadata and cached_content.usage_metadata.total_token_count:
+            with _STATS_LOCK:
+                TOKEN_USAGE[CONTEXT_CACHE_USAGE_KEY]["cache_write"] += cached_content.usage_metadata.total_token_count
+
+        cached_llm = ChatGoogleGenerativeAI(
+            model=llm.model,
+            google_api_key=llm.google_api_key,
+            temperature=llm.temperature,
+            cached_content=cached_content.name
+        )
+        _CACHE[key] = (cached_content, cached_llm)
+        while len(_CACHE) > CONTEXT_CACHE_MAX_ENTRIES:
+            _, (evicted_content, _) = _CACHE.popitem(last=False)
+            _delete_context_cache(evicted_content)
+        return cached_llm
+
+
+def release_context_caches():
+    """
+    Deletes every context cache created in this session instead of waiting for the TTL.
+    """
+    with _CACHE_LOCK:
+        while _CACHE:
+            _, (cached_content, _) = _CACHE.popitem()
+            _delete_context_cache(cached_content)
+
+
+def _get_tool_response_cache(llm: ChatGoogleGenerativeAI) -> LLMCache:
+    global _TOOL_RESPONSE_CACHE
+    if _TOOL_RESPONSE_CACHE is None:
+        _TOOL_RESPONSE_CACHE = LLMCache(
+            google_api_key=llm.google_api_key.get_secret_value(),
+            maxsize=1024,
+            path=None,   # Kept in memory only; tool answers expire after the TTL
+            ttl_seconds=TOOL_CACHE_TTL_SECONDS
+        )
+    return _TOOL_RESPONSE_CACHE
+
+
+def document_token_count(llm: ChatGoogleGenerativeAI, file_context: dict) -> int | None:
+    """
+    Returns the number of prompt tokens the uploaded document costs, or None if it cannot be counted.
+    Counted once per document with the count_tokens API, which does not run the model.
+    Call it in the background after upload; cache hits only read the stored count.
+    """
+    digest = file_context["digest"]
+    with _TOKEN_COUNT_LOCK:
+        if digest not in _DOCUMENT_TOKEN_COUNTS:
+            pdf_file: File = file_context["file"]
+            try:
+                result = get_genai_client().models.count_tokens(
+                    model=llm.model,
+                    contents=[Part.from_uri(file_uri=pdf_file.uri, mime_type=pdf_file.mime_type)]
+                )
+                _DOCUMENT_TOKEN_COUNTS[digest] = result.total_tokens
+            except Exception as e:
+                logger.warning("Could not count document tokens: %s", e)
+                _DOCUMENT_TOKEN_COUNTS[digest] = None
+        return _DOCUMENT_TOKEN_COUNTS[digest]
+
+
+def _estimated_prefill_tokens(file_context: dict, tool_name: str | None) -> int:
+    """
+    Estimates the prompt tokens a request would have sent: the facts table for FACTS_TOOLS once it is
+    attached (about 4 characters per token), else the average input tokens recorded for the tool
+    (or for all tools when tool_name is None), else the full document if it has been counted.
+    Never makes a request, so it is safe on the cache-hit path. Call with _STATS_LOCK held.
+    """
+    facts = file_context.get("facts")
+    if tool_name in FACTS_TOOLS and facts:
+        return len(facts) // 4
+    if tool_name is None:
+        counters = [c for name, c in TOKEN_USAGE.items() if name != CONTEXT_CACHE_USAGE_KEY]
+    else:
+        counters = [TOKEN_USAGE[tool_name]] if tool_name in TOKEN_USAGE else []
+    calls = sum(c["calls"] for c in counters)
+    if calls:
+        return sum(c["input"] for c in counters) // calls
+    return _DOCUMENT_TOKEN_COUNTS.get(file_context["digest"]) or 0
+
+
+def record_cache_hit(file_context: dict, tool_name: str | None = None):
+    """
+    Counts a cached answer and the prefill it avoided, estimated from what the request would have sent.
+    tool_name is the tool whose answer was cached, or None for a whole agent answer.
+    """
+    with _STATS_LOCK:
+        CACHE_STATS["hits"] += 1
+        CACHE_STATS["prefill_tokens_saved"] += _estimated_prefill_tokens(file_context, tool_name)
+
+
+@functools.lru_cache(maxsize=32)
+def _document_instructions(instructions_template: str, display_name: str) -> str:
+    """
+    Formats a tool's instructions for one document. Built once, then the same string is reused by every call.
+    """
+    return instructions_template.format(display_name=display_name)
+
+
+def _record_usage(tool_name: str, usage: dict | None):
+    """
+    Adds the usage_metadata of one model response to TOKEN_USAGE.
+    """
+    if not usage:
+        return
+    cache_read = (usage.get("input_token_details") or {}).get("cache_read") or 0
+    with _STATS_LOCK:
+        counters = TOKEN_USAGE[tool_name]
+        counters["calls"] += 1
+        counters["input"] += usage["input_tokens"]
+        counters["output"] += usage["output_tokens"]
+        counters["cache_read"] += cache_read
+    logger.debug("tool=%s input_tokens=%d output_tokens=%d cache_read_tokens=%d",
+                 tool_name, usage["input_tokens"], usage["output_tokens"], cache_read)
+
+
+def token_usage_report() -> list[str]:
+    """
+    Returns one line per tool summarising its token usage and context cache hit ratio.
+    """
+    with _STATS_LOCK:
+        usage = {tool_name: Counter(counters) for tool_name, counters in TOKEN_USAGE.items()}
+    lines = []
+    for tool_name, counters in sorted(usage.items()):
+        if tool_name == CONTEXT_CACHE_USAGE_KEY:
+            lines.append(f"{tool_name}: {counters['cache_write']} tokens written")
+            continue
+        ratio = counters["cache_read"] / counters["input"] if counters["input"] else 0.0
+        lines.append(
+            f"{tool_name}: {counters['calls']} calls, {counters['input']} input tokens "
+            f"({counters['cache_read']} from context cache, {ratio:.0%}), {counters['output']} output tokens"
+        )
+    return lines
+
+
+def _prompt_parts(instructions_template: str, query_template: str, display_name: str, query: str) -> list[str]:
+    """
+    Returns a tool prompt as [shared instructions, per-call query part], without concatenating them.
+    """
+    return [_document_instructions(instructions_template, display_name), query_template.format(query=query)]
+
+
+@_llm_retry
+def _llm_call(request_llm: Runnable, messages: list):
+    """
+    Invokes the model, retrying transient errors.
+    """
+    return request_llm.invoke(messages)
+
+
+@_llm_retry
+async def _allm_call(request_llm: Runnable, messages: list):
+    """
+    Async variant of _llm_call. The concurrency slot is only held during the request, not while backing off.
+    """
+    async with _LLM_SEMAPHORE:
+        return await request_llm.ainvoke(messages)
+
+
+@_llm_retry
+def _open_stream(request_llm: Runnable, messages: list) -> tuple[Iterator[AIMessageChunk], AIMessageChunk | None]:
+    """
+    Starts a streamed request and waits for its first chunk, retrying transient errors.
+    Errors surface on the first chunk, so only this part is retried: once chunks have been shown
+    the answer cannot be replayed. Returns the stream and its first chunk (None if it is empty).
+    """
+    stream = request_llm.stream(messages)
+    return stream, next(stream, None)
+
+
+@_llm_retry
+async def _aopen_stream(request_llm: Runnable,
+                        messages: list) -> tuple[AsyncIterator[AIMessageChunk], AIMessageChunk | None]:
+    """
+    Async variant of _open_stream. On success the caller holds a concurrency slot for the rest of
+    the stream and must release _LLM_SEMAPHORE; a failed attempt releases it before backing off.
+    """
+    await _LLM_SEMAPHORE.acquire()
     try:
-        messages = [
-            SystemMessage(content=f"You are an AI assistant for extracting key financial metrics from all content in uploaded PDF files."),
-            HumanMessage(
-                content=[
-                    #gemini_file_object,
-                    prompt_text
-                ])
-        ]
-        response = llm.invoke(messages)
+        stream = request_llm.astream(messages)
+        return stream, await anext(stream, None)
+    except BaseException:
+        _LLM_SEMAPHORE.release()
+        raise
+
+
+def _lookup_tool_response(llm: ChatGoogleGenerativeAI, file_context: dict, tool_name: str,
+                          query: str) -> tuple[str | None, str, str, np.ndarray | None]:
+    """
+    Looks up tool_name's answer for this query on this document: exact match, then a similar earlier query.
+    Returns (cached answer or None, key, scope, query embedding). On a miss, pass the last three to
+    _store_tool_response with the new answer, so the query is embedded only once.
+    """
+    scope = f"{tool_name}:{file_context['digest']}"
+    key = cache_key(scope, query, llm.model)
+    response, query_embedding = _get_tool_response_cache(llm).lookup(key, query, scope)
+    if response is not None:
+        logger.debug("tool=%s cache=hit query=%s", tool_name, query)
+        record_cache_hit(file_context, tool_name)
+    return response, key, scope, query_embedding
+
+
+def _store_tool_response(llm: ChatGoogleGenerativeAI, key: str, scope: str, response: str,
+                         query_embedding: np.ndarray | None):
+    _get_tool_response_cache(llm).set(key, response, query_embedding, scope)
+
+
+def _cached_response(llm: ChatGoogleGenerativeAI, file_context: dict, tool_name: str, query: str,
+                     compute: Callable[[], str]) -> str:
+    """
+    Returns the cached answer of tool_name for this query on this document, or computes and stores it.
+    Repeated or paraphrased queries are served without calling the LLM.
+    """
+    response, key, scope, query_embedding = _lookup_tool_response(llm, file_context, tool_name, query)
+    if response is not None:
+        return response
+
+    response = compute()
+    _store_tool_response(llm, key, scope, response, query_embedding)
+    return response
+
+
+async def _acached_response(llm: ChatGoogleGenerativeAI, file_context: dict, tool_name: str, query: str,
+                            acompute: Callable[[], Awaitable[str]]) -> str:
+    """
+    Async variant of _cached_response. The lookup (which may embed the query) runs on a worker thread.
+    """
+    response, key, scope, query_embedding = await asyncio.to_thread(
+        _lookup_tool_response, llm, file_context, tool_name, query
+    )
+    if response is not None:
+        return response
+
+    response = await acompute()
+    _store_tool_response(llm, key, scope, response, query_embedding)
+    return response
+
+
+def invoke_with_document(llm: ChatGoogleGenerativeAI, file_context: dict, tool_name: str,
+                         system_text: str, prompt_parts: list[str], query: str) -> str:
+    """
+    Answers a tool prompt about the uploaded document, using the tool response cache.
+    """
+    def compute() -> str:
+        request_llm, messages = _document_request(
+            llm, file_context, system_text, prompt_parts, use_facts=tool_name in FACTS_TOOLS
+        )
+        response = _llm_call(request_llm, messages)
+        _record_usage(tool_name, response.usage_metadata)
+        return response.content
+
+    return _cached_response(llm, file_context, tool_name, query, compute)
+
+
+async def ainvoke_with_document(llm: ChatGoogleGenerativeAI, file_context: dict, tool_name: str,
+                                system_text: str, prompt_parts: list[str], query: str) -> str:
+    """
+    Async variant of invoke_with_document. Several tools can await it concurrently;
+    the number of in-flight LLM requests is bounded by MAX_CONCURRENT_LLM_CALLS.
+    """
+    async def acompute() -> str:
+        # Building the request may create the context cache, a blocking SDK call
+        request_llm, messages = await asyncio.to_thread(
+            _document_request, llm, file_context, system_text, prompt_parts, tool_name in FACTS_TOOLS
+        )
+        response = await _allm_call(request_llm, messages)
+        _record_usage(tool_name, response.usage_metadata)
         return response.content
-    except Exception as e:
-        return f"Error in Highlight Key Financial Metrics Tool: {str(e)}"
+
+    return await _acached_response(llm, file_context, tool_name, query, acompute)
+
+
+async def astream_with_document(llm: ChatGoogleGenerativeAI, file_context: dict, tool_name: str,
+                                system_text: str, prompt_parts: list[str], query: str) -> AsyncIterator[str]:
+    """
+    Streaming variant of ainvoke_with_document: yields the answer chunk by chunk as it is generated,
+    so the first tokens can be shown long before the full answer is ready.
+    The chunks are joined once the stream completes and the full text is written to the tool response cache.
+    A cached answer is yielded as a single chunk.
+    """
+    response, key, scope, query_embedding = await asyncio.to_thread(
+        _lookup_tool_response, llm, file_context, tool_name, query
+    )
+    if response is not None:
+        yield response
+        return
+
+    request_llm, messages = await asyncio.to_thread(
+        _document_request, llm, file_context, system_text, prompt_parts, tool_name in FACTS_TOOLS
+    )
+    response_parts: list[str] = []
+    usage = _new_stream_usage()
+    stream, chunk = await _aopen_stream(request_llm, messages)
+    try:
+        while chunk is not None:
+            _add_chunk_usage(usage, chunk)
+            if chunk.content:
+                response_parts.append(chunk.content)
+                yield chunk.content
+            chunk = await anext(stream, None)
+    finally:
+        _LLM_SEMAPHORE.release()
+    _record_usage(tool_name, usage)
+    _store_tool_response(llm, key, scope, "".join(response_parts), query_embedding)
+
+
+def stream_with_document(llm: ChatGoogleGenerativeAI, file_context: dict, tool_name: str,
+                         system_text: str, prompt_parts: list[str], query: str) -> Iterator[str]:
+    """
+    Sync variant of astream_with_document, for callers that write chunks out as they arrive
+    instead of holding the whole answer.
+    """
+    response, key, scope, query_embedding = _lookup_tool_response(llm, file_context, tool_name, query)
+    if response is not None:
+        yield response
+        return
+
+    request_llm, messages = _document_request(
+        llm, file_context, system_text, prompt_parts, use_facts=tool_name in FACTS_TOOLS
+    )
+    response_parts: list[str] = []
+    usage = _new_stream_usage()
+    stream, chunk = _open_stream(request_llm, messages)
+    while chunk is not None:
+        _add_chunk_usage(usage, chunk)
+        if chunk.content:
+            response_parts.append(chunk.content)
+            yield chunk.content
+        chunk = next(stream, None)
+    _record_usage(tool_name, usage)
+    _store_tool_response(llm, key, scope, "".join(response_parts), query_embedding)
+
+
+def _new_stream_usage() -> dict:
+    return {"input_tokens": 0, "output_tokens": 0, "input_token_details": {"cache_read": 0}}
+
+
+def _add_chunk_usage(usage: dict, chunk: AIMessageChunk):
+    """
+    Adds a streamed chunk's usage_metadata to the running usage of the stream.
+    """
+    if chunk.usage_metadata:
+        # Input and output counts arrive as per-chunk deltas; cache_read is repeated on every chunk
+        usage["input_tokens"] += chunk.usage_metadata["input_tokens"]
+        usage["output_tokens"] += chunk.usage_metadata["output_tokens"]
+        usage["input_token_details"] = chunk.usage_metadata.get("input_token_details") or {}
+
+
+def _tool_error(label: str, error: Exception) -> str:
+    """
+    Counts a failed tool call in TOOL_ERRORS and returns the message the agent sees as the tool's output.
+    """
+    TOOL_ERRORS[label] += 1
+    return f"Error in {label} Tool: {str(error)}"
+
+
+def _guarded_stream(chunks: Iterator[str], label: str) -> Iterator[str]:
+    """
+    Passes chunks through; a provider error raised mid-stream becomes the tool's error message.
+    """
+    try:
+        yield from chunks
+    except _PROVIDER_ERRORS as e:
+        yield _tool_error(label, e)
+
+
+def _document_request(llm: ChatGoogleGenerativeAI, file_context: dict, system_text: str,
+                      prompt_parts: list[str], use_facts: bool = False) -> tuple[ChatGoogleGenerativeAI, list]:
+    """
+    Builds a tool request about the uploaded document: the LLM to call (bound to the
+    context cache when available) and the messages to send it.
+    With use_facts, the pre-extracted facts table replaces the document if it is available.
+
+    Prefix-stability invariant: every request is laid out as
+    [shared system instruction][document][tool role][tool instructions ... user query last].
+    Everything before the tool role is byte-identical for all tools and questions on a document,
+    so it can be served from the explicit context cache or the provider's implicit prefix cache.
+    Keep per-call values (the query) at the end when editing the prompts.
+    """
+    facts = file_context.get("facts") if use_facts else None
+    if facts:
+        return llm, [_FACTS_SYSTEM_MESSAGE, HumanMessage(content=[facts, system_text, *prompt_parts])]
+
+    cached_llm = _get_cached_llm(llm, file_context)
+    if cached_llm is not None:
+        # The cache already holds the system instruction and document; Gemini does not
+        # accept a system message alongside cached content, so the tool role goes in the user turn.
+        return cached_llm, [HumanMessage(content=[system_text, *prompt_parts])]
+
+    gemini_file_object = file_context["file"]
+    messages = [
+        _DOCUMENT_SYSTEM_MESSAGE,
+        HumanMessage(
+            content=[
+                {"type": "media", "file_uri": gemini_file_object.uri, "mime_type": gemini_file_object.mime_type},
+                system_text,
+                *prompt_parts
+            ]
+        )
+    ]
+    return llm, messages
+
+
+class AnalysisSchema(BaseModel):
+    """
+    Summary, revenue trends and key metrics of a financial report, produced in one LLM call.
+    """
+    summary: str = Field(description="Concise executive summary of the key financial results and overall performance.")
+    revenue_trends: str = Field(description="Revenue figures, period-over-period changes and their drivers.")
+    key_metrics: str = Field(description="Key financial metrics with their values and periods, one per line.")
+
+
+# Gemini JSON mode. Passed as generation config rather than via with_structured_output, which binds
+# a function tool: requests on cached content cannot carry tools.
+_JSON_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+_ANALYSIS_PARSER = PydanticOutputParser(pydantic_object=AnalysisSchema)
+_FULL_ANALYSIS_LABEL = "Full Report Analysis"   # Label used in the tool's error messages
+
+
+def _parse_analysis(message: AIMessage) -> str:
+    """
+    Records the usage of a JSON-mode response and returns the validated analysis as JSON.
+    """
+    _record_usage("FullReportAnalysis", message.usage_metadata)
+    return json.dumps(_ANALYSIS_PARSER.invoke(message).model_dump())
+
+
+def _analysis_prompt_parts(query: str, file_context: dict) -> list[str]:
+    """
+    Returns the full analysis prompt for the query as _prompt_parts does. Shared by the sync and async paths.
+    """
+    display_name = file_context["display_name"]
+    logger.debug("tool=%s query=%s file=%s", "FullReportAnalysis", query, display_name)
+    return _prompt_parts(_FULL_ANALYSIS_INSTRUCTIONS_TMPL, _FULL_ANALYSIS_QUERY_TMPL, display_name, query)
+
+
+def _format_analysis(analysis: dict) -> str:
+    """
+    Lays out the three sections of an analysis as the text the agent sees.
+    """
+    return (
+        f"Executive Summary:\n{analysis['summary']}\n\n"
+        f"Revenue Trends:\n{analysis['revenue_trends']}\n\n"
+        f"Key Financial Metrics:\n{analysis['key_metrics']}"
+    )
+
+
+def analyze_report(query: str, file_context: dict, llm: ChatGoogleGenerativeAI) -> dict:
+    """
+    Runs the summary, revenue trend and key metrics analyses as a single structured LLM call,
+    paying for one document prefill instead of three.
+    Returns a dict with the keys 'summary', 'revenue_trends' and 'key_metrics'.
+    """
+    prompt_parts = _analysis_prompt_parts(query, file_context)
+
+    def compute() -> str:
+        request_llm, messages = _document_request(llm, file_context, SYSTEM_FULL_ANALYSIS, prompt_parts)
+        json_llm = request_llm.bind(generation_config=_JSON_GENERATION_CONFIG)
+        return _parse_analysis(_llm_call(json_llm, messages))
+
+    return json.loads(_cached_response(llm, file_context, "FullReportAnalysis", query, compute))
+
+
+async def analyze_report_async(query: str, file_context: dict, llm: ChatGoogleGenerativeAI) -> dict:
+    """
+    Async variant of analyze_report.
+    """
+    prompt_parts = _analysis_prompt_parts(query, file_context)
+
+    async def acompute() -> str:
+        request_llm, messages = await asyncio.to_thread(
+            _document_request, llm, file_context, SYSTEM_FULL_ANALYSIS, prompt_parts
+        )
+        json_llm = request_llm.bind(generation_config=_JSON_GENERATION_CONFIG)
+        return _parse_analysis(await _allm_call(json_llm, messages))
+
+    return json.loads(await _acached_response(llm, file_context, "FullReportAnalysis", query, acompute))
+
+
+def _run_text_tool(tool_name: str, query: str, file_context: dict, llm: ChatGoogleGenerativeAI,
+                   stream: bool = False) -> str | Iterator[str]:
+    """
+    Answers the query with one of the TEXT_TOOLS.
+    With stream=True, returns an iterator over the answer's chunks instead of one string.
+    """
+    label, system_text, instructions_template, query_template = TEXT_TOOLS[tool_name]
+    display_name = file_context["display_name"]
+    logger.debug("tool=%s stream=%s query=%s file=%s", tool_name, stream, query, display_name)
+    prompt_parts = _prompt_parts(instructions_template, query_template, display_name, query)
+
+    if stream:
+        return _guarded_stream(
+            stream_with_document(llm, file_context, tool_name, system_text, prompt_parts, query),
+            label
+        )
+    try:
+        return invoke_with_document(
+            llm, file_context, tool_name,
+            system_text=system_text,
+            prompt_parts=prompt_parts,
+            query=query
+        )
+    except _PROVIDER_ERRORS as e:
+        return _tool_error(label, e)
+
+
+async def _arun_text_tool(tool_name: str, query: str, file_context: dict, llm: ChatGoogleGenerativeAI) -> str:
+    """
+    Async variant of _run_text_tool, without streaming (see stream_tool_async).
+    """
+    label, system_text, instructions_template, query_template = TEXT_TOOLS[tool_name]
+    display_name = file_context["display_name"]
+    logger.debug("tool=%s query=%s file=%s", tool_name, query, display_name)
+
+    try:
+        return await ainvoke_with_document(
+            llm, file_context, tool_name,
+            system_text=system_text,
+            prompt_parts=_prompt_parts(instructions_template, query_template, display_name, query),
+            query=query
+        )
+    except _PROVIDER_ERRORS as e:
+        return _tool_error(label, e)
+
+
+async def stream_tool_async(tool_name: str, query: str, file_context: dict,
+                            llm: ChatGoogleGenerativeAI) -> AsyncIterator[str]:
+    """
+    Streams the answer of one of the TEXT_TOOLS for the query.
+    Produces the same text as the tool's async variant, but chunk by chunk.
+    """
+    label, system_text, instructions_template, query_template = TEXT_TOOLS[tool_name]
+    display_name = file_context["display_name"]
+    logger.debug("tool=%s stream=true query=%s file=%s", tool_name, query, display_name)
+
+    try:
+        async for chunk in astream_with_document(
+            llm, file_context, tool_name,
+            system_text=system_text,
+            prompt_parts=_prompt_parts(instructions_template, query_template, display_name, query),
+            query=query
+        ):
+            yield chunk
+    except _PROVIDER_ERRORS as e:
+        yield _tool_error(label, e)
+
+
+# @tool
+def generate_summary_tool(query: str, file_context: dict, llm: ChatGoogleGenerativeAI,
+                          stream: bool = False) -> str | Iterator[str]:
+    """
+    Generates a concise summary of the provided financial document (PDF via File API).
+    The input 'query' can be a general request for summary, e.g., 'summarize the report'.
+    This tool analyzes the entire document content, including text and visual elements from the uploaded PDF.
+    """
+    return _run_text_tool("FinancialSummary", query, file_context, llm, stream)
+
+
+async def generate_summary_tool_async(query: str, file_context: dict, llm: ChatGoogleGenerativeAI) -> str:
+    """
+    Async variant of generate_summary_tool.
+    """
+    return await _arun_text_tool("FinancialSummary", query, file_context, llm)
+
+
+#@tool
+def detect_revenue_trends_tool(query: str, file_context: dict, llm: ChatGoogleGenerativeAI,
+                               stream: bool = False) -> str | Iterator[str]:
+    """
+    Analyzes the financial document (PDF via File API) to identify and describe revenue trends.
+    The input 'query' should be a question about revenue, e.g., 'What are the revenue
+    trends?' or 'How did revenue change?'
+    This tool considers all content, including tables and charts that might show revenue data.
+    """
+    return _run_text_tool("RevenueTrendAnalysis", query, file_context, llm, stream)
+
+
+async def detect_revenue_trends_tool_async(query: str, file_context: dict, llm: ChatGoogleGenerativeAI) -> str:
+    """
+    Async variant of detect_revenue_trends_tool.
+    """
+    return await _arun_text_tool("RevenueTrendAnalysis", query, file_context, llm)
+
+
+#@tool
+def highlight_key_financial_metrics_tool(query: str, file_context: dict, llm: ChatGoogleGenerativeAI,
+                                         stream: bool = False) -> str | Iterator[str]:
+    """
+    Extracts and lists key financial metrics from the document (PDF via File API).
+    The input 'query' should be a request for key metrics, e.g., 'What are the key financial metrics?' or 'List important financial figures'.
+    This tool identifies metrics like Net Income, EPS, Profit Margins, Operating Expenses, Cash Flow, etc., with their values,
+    by analyzing all content, including numbers that might be in tables or charts.
+    """
+    return _run_text_tool("KeyFinancialMetricsExtraction", query, file_context, llm, stream)
+
+
+async def highlight_key_financial_metrics_tool_async(query: str, file_context: dict, llm: ChatGoogleGenerativeAI) -> str:
+    """
+    Async variant of highlight_key_financial_metrics_tool.
+    """
+    return await _arun_text_tool("KeyFinancialMetricsExtraction", query, file_context, llm)
+
+
+#@tool
+def full_report_analysis_tool(query: str, file_context: dict, llm: ChatGoogleGenerativeAI) -> str:
+    """
+    Produces a complete analysis of the financial document (PDF via File API) in one step:
+    an executive summary, the revenue trends and the key financial metrics.
+    Use this for broad requests such as 'analyze this report' or 'give me the full picture',
+    instead of calling the summary, revenue and metrics tools one after another.
+    """
+    try:
+        return _format_analysis(analyze_report(query, file_context, llm))
+    except _PROVIDER_ERRORS as e:
+        return _tool_error(_FULL_ANALYSIS_LABEL, e)
+
+
+async def full_report_analysis_tool_async(query: str, file_context: dict, llm: ChatGoogleGenerativeAI) -> str:
+    """
+    Async variant of full_report_analysis_tool.
+    """
+    try:
+        return _format_analysis(await analyze_report_async(query, file_context, llm))
+    except _PROVIDER_ERRORS as e:
+        return _tool_error(_FULL_ANALYSIS_LABEL, e)
@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections.abc import Callable
+
+from google import genai
+
+
+@functools.lru_cache(maxsize=1)
+def get_genai_client() -> genai.Client:
+    """
+    Returns the Google GenAI SDK client shared by the whole process, created on first use.
+    Reusing one client keeps a single connection pool and auth session for all file operations.
+    """
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
+
+def load_json_cache(path: str) -> dict:
+    """
+    Reads a JSON cache file. Returns an empty dict if it is missing or unreadable.
+    """
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[Cache] Could not read '{path}': {e}")
+        return {}
+
+
+def save_json_cache(path: str, data: dict):
+    """
+    Writes a JSON cache file, creating its directory if needed.
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+    except OSError as e:
+        print(f"[Cache] Could not write '{path}': {e}")
+
+
+async def run_in_daemon_thread(func: Callable, *args):
+    """
+    Awaits func(*args) run on a daemon thread.
+    Unlike asyncio.to_thread, asyncio.run does not wait for the thread at shutdown, so a call
+    that blocks indefinitely (e.g. input()) or for a long time cannot hold up Ctrl-C or exit.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result, error: BaseException | None):
+        if not future.done():   # The awaiting task may have been cancelled meanwhile
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def run():
+        try:
+            outcome = (func(*args), None)
+        except BaseException as e:
+            outcome = (None, e)
+        try:
+            loop.call_soon_threadsafe(settle, *outcome)
+        except RuntimeError:
+            pass   # The event loop has already closed
+
+    threading.Thread(target=run, daemon=True).start()
+    return await future
+
+
+def file_digest(path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    Returns the SHA-256 hex digest of a file's content, read in blocks.
+    Identical files get the same digest regardless of their name or location.
+    """
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class StreamPrinter:
+    """
+    Writes streamed text to stdout in batches instead of flushing every chunk.
+    The first chunk is written immediately so time-to-first-token is unchanged.
+    After that, chunks are buffered until `interval` seconds have passed or
+    `max_chars` characters are waiting.
+    """
+
+    def __init__(self, interval: float = 0.05, max_chars: int = 64):
+        self.interval = interval
+        self.max_chars = max_chars
+        self._buffer: list[str] = []
+        self._buffered_chars = 0
+        self._last_flush: float | None = None
+
+    def write(self, text: str):
+        self._buffer.append(text)
+        self._buffered_chars += len(text)
+        now = time.monotonic()
+        if (self._last_flush is None
+                or now - self._last_flush >= self.interval
+                or self._buffered_chars >= self.max_chars):
+            self.flush(now)
+
+    def flush(self, now: float | None = None):
+        if self._buffer:
+            sys.stdout.write("".join(self._buffer))
+            sys.stdout.flush()
+            self._buffer.clear()
+            self._buffered_chars = 0
+        self._last_flush = now if now is not None else time.monotonic()